@@ -1,14 +1,15 @@
 """Control script for the DronePi user inerface."""
+import os
 import sys
 import yaml
-import time
 import logging
 import traceback
 import numpy as np
 import pandas as pd
 import pyqtgraph as pg
 from PyQt5.QtGui import QIcon, QFont, QPalette, QColor
-from PyQt5.QtCore import Qt, QThread, QObject, pyqtSignal
+from PyQt5.QtCore import (Qt, QThread, QObject, QTimer, QEventLoop,
+                          pyqtSignal)
 from PyQt5.QtWidgets import (QMainWindow, QApplication, QWidget, QGridLayout,
                              QScrollArea, QSplitter, QLabel, QLineEdit,
                              QPushButton, QPlainTextEdit)
@@ -16,14 +17,82 @@ from PyQt5.QtWidgets import (QMainWindow, QApplication, QWidget, QGridLayout,
 from ifit.pispec import PiSpec
 from ifit.gui_functions import Widgets
 
+# Use the C yaml implementation if libyaml is available
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+# Numba is optional, used to accelerate the scatter color computation
+try:
+    from numba import njit, prange
+    NUMBA_FLAG = True
+except ImportError:
+    NUMBA_FLAG = False
+
+
+def _compute_color_bins(values, lo, hi, nbins, out):
+    """Quantize data values into colormap bin indices."""
+    norm = np.nan_to_num((values - lo) / (hi - lo))
+    out[:values.shape[0]] = np.clip(norm * (nbins - 1), 0,
+                                    nbins - 1).astype(np.uint8)
+    return out[:values.shape[0]]
+
+
+if NUMBA_FLAG:
+    @njit(parallel=True, cache=True)
+    def _compute_color_bins(values, lo, hi, nbins, out):  # noqa: F811
+        """Quantize data values into colormap bin indices."""
+        scale = hi - lo
+        for i in prange(values.shape[0]):
+            norm = (values[i] - lo) / scale
+            if not norm >= 0.0:  # also catches nans
+                norm = 0.0
+            elif norm > 1.0:
+                norm = 1.0
+            out[i] = np.uint8(norm * (nbins - 1))
+        return out[:values.shape[0]]
+
 
 logger = logging.getLogger()
 
 
+# Render plots with OpenGL so curve/scatter drawing is pushed to the GPU
+try:
+    pg.setConfigOptions(useOpenGL=True, enableExperimental=True,
+                        antialias=False)
+except Exception:
+    logger.warning('Unable to enable OpenGL rendering')
+
+
 COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b',
           '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
 
 
+def _build_dark_palette():
+    """Build the dark theme palette once at import."""
+    palette = QPalette()
+    palette.setColor(QPalette.Window, QColor(53, 53, 53))
+    palette.setColor(QPalette.WindowText, Qt.white)
+    palette.setColor(QPalette.Base, QColor(25, 25, 25))
+    palette.setColor(QPalette.AlternateBase, QColor(53, 53, 53))
+    palette.setColor(QPalette.ToolTipBase, Qt.black)
+    palette.setColor(QPalette.ToolTipText, Qt.white)
+    palette.setColor(QPalette.Text, Qt.white)
+    palette.setColor(QPalette.Button, QColor(53, 53, 53))
+    palette.setColor(QPalette.Active, QPalette.Button, QColor(53, 53, 53))
+    palette.setColor(QPalette.ButtonText, Qt.white)
+    palette.setColor(QPalette.BrightText, Qt.red)
+    palette.setColor(QPalette.Link, QColor(42, 130, 218))
+    palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
+    palette.setColor(QPalette.HighlightedText, Qt.black)
+    palette.setColor(QPalette.Disabled, QPalette.ButtonText, Qt.darkGray)
+    return palette
+
+
+DARK_PALETTE = _build_dark_palette()
+
+
 class MainWindow(QMainWindow):
     """View for the iFit GUI."""
 
@@ -64,6 +133,29 @@ class MainWindow(QMainWindow):
 
         self.connection_flag = False
 
+        # Count of PiSpec log lines already shown in the log pane
+        self._log_nlines = 0
+
+        # Coalesce rapid plot updates into a single redraw and pause
+        # redrawing while the user is interacting with the plots
+        self._pending_plot_data = None
+        self._interacting = False
+        self._plot_timer = QTimer(self)
+        self._plot_timer.setSingleShot(True)
+        self._plot_timer.setInterval(100)
+        self._plot_timer.timeout.connect(self._do_update_plots)
+        self._interact_timer = QTimer(self)
+        self._interact_timer.setSingleShot(True)
+        self._interact_timer.setInterval(200)
+        self._interact_timer.timeout.connect(self._interaction_finished)
+
+        # Debounce keystrokes in the volcano location inputs
+        self._last_volc = None
+        self._vol_timer = QTimer(self)
+        self._vol_timer.setSingleShot(True)
+        self._vol_timer.setInterval(150)
+        self._vol_timer.timeout.connect(self.update_map)
+
         self._createApp()
         self.changeThemeDark()
 
@@ -141,26 +233,51 @@ class MainWindow(QMainWindow):
         log_layout.addWidget(self.log, 0, 0)
 
         self.graphwin = pg.GraphicsLayoutWidget(show=True)
+
+        # Single pen shared by all the plot axes
+        self._axis_pen = pg.mkPen('w', width=1.5)
+
         x_axis = pg.DateAxisItem(utcOffset=0)
         self.graphAx = self.graphwin.addPlot(row=0, col=0,
                                              axisItems={'bottom': x_axis})
         self.mapAx = self.graphwin.addPlot(row=0, col=1)
         self.mapAx.setAspectLocked(True)
 
-        # Add plots
-        self.graphPlot = pg.PlotCurveItem(pen=pg.mkPen(COLORS[0]))
+        # Add plots, downsampling and clipping the curves to the visible
+        # range so redraw cost is independent of the history length
+        self.graphPlot = pg.PlotDataItem(pen=pg.mkPen(COLORS[0]))
+        self.graphPlot.setDownsampling(auto=True, method='peak')
+        self.graphPlot.setClipToView(True)
         self.graphAx.addItem(self.graphPlot)
-        self.mapPlot = pg.PlotCurveItem(pen=pg.mkPen(COLORS[2]))
-        self.mapScatter = pg.ScatterPlotItem()
-        self.mapAx.addItem(self.mapScatter)
+        self.mapPlot = pg.PlotDataItem(pen=pg.mkPen(COLORS[2]))
+        self.mapPlot.setDownsampling(auto=True, method='peak')
+        self.mapPlot.setClipToView(True)
         self.volcPlot = pg.ScatterPlotItem(size=15, pen=pg.mkPen(COLORS[7]),
                                            brush=pg.mkBrush(COLORS[3]))
         self.mapAx.addItem(self.volcPlot)
 
         # Generate the colorbar
         self.cmap = pg.colormap.get('viridis')
+
+        # Create one map scatter item per color bin, each with a single
+        # shared pen and brush, so pyqtgraph can reuse its symbol atlas
+        self._nmap_bins = 16
+        self._bin_scatters = []
+        for i in range(self._nmap_bins):
+            color = self.cmap.map(i / (self._nmap_bins - 1))
+            scatter = pg.ScatterPlotItem(pen=pg.mkPen(color=color),
+                                         brush=pg.mkBrush(color=color),
+                                         pxMode=True, useCache=True)
+            self.mapAx.addItem(scatter)
+            self._bin_scatters.append(scatter)
+
+        # Reusable output buffer for the color bins, grown on demand
+        self._bin_buf = np.empty(0, dtype=np.uint8)
+
         im = pg.ImageItem()
         self.so2_data = []
+        self.map_lon = None
+        self.map_lat = None
         self.cbar = pg.ColorBarItem(values=(0, 100), colorMap=self.cmap)
         self.cbar.setImageItem(im)
         self.cbar.sigLevelsChangeFinished.connect(self._update_map_colors)
@@ -176,18 +293,33 @@ class MainWindow(QMainWindow):
         output_layout = QGridLayout(self.graphFrame)
         output_layout.addWidget(self.graphwin, 0, 0)
 
-        # Connect changes in the volcano location to the plot
-        self.widgets['vlat'].textChanged.connect(self.update_map)
-        self.widgets['vlon'].textChanged.connect(self.update_map)
+        # Connect changes in the volcano location to the plot, debounced
+        # so typing a coordinate triggers a single update
+        self.widgets['vlat'].textChanged.connect(
+            lambda: self._vol_timer.start())
+        self.widgets['vlon'].textChanged.connect(
+            lambda: self._vol_timer.start())
+
+        # Suppress plot redraws while the user is panning or zooming
+        self.graphAx.vb.sigRangeChangedManually.connect(
+            self._interaction_started)
+        self.mapAx.vb.sigRangeChangedManually.connect(
+            self._interaction_started)
 
     def update_map(self):
         """Update the volcano location."""
         try:
             x = float(self.widgets.get('vlon'))
             y = float(self.widgets.get('vlat'))
-            self.volcPlot.setData([x], [y])
         except ValueError:
-            pass
+            return
+
+        # Skip the update if the location is unchanged
+        if (x, y) == self._last_volc:
+            return
+        self._last_volc = (x, y)
+
+        self.volcPlot.setData([x], [y])
 
     def connect_pispec(self):
         """Connect to the PiSpec."""
@@ -252,7 +384,33 @@ class MainWindow(QMainWindow):
         self.syncThread.start()
 
     def update_plots(self, plot_data):
+        """Queue a plot update, coalescing rapid updates."""
+        self._pending_plot_data = plot_data
+        if not self._plot_timer.isActive():
+            self._plot_timer.start()
+
+    def _interaction_started(self):
+        """Flag that the user is interacting with the plots."""
+        self._interacting = True
+        self._interact_timer.start()
+
+    def _interaction_finished(self):
+        """Resume plot updates after user interaction ends."""
+        self._interacting = False
+        if self._pending_plot_data is not None:
+            self._plot_timer.start()
+
+    def _do_update_plots(self):
         """Update data plots."""
+        # Hold off redrawing while the user is panning or zooming
+        if self._interacting:
+            return
+
+        plot_data = self._pending_plot_data
+        if plot_data is None:
+            return
+        self._pending_plot_data = None
+
         # Unpack the data
         timestamp, lat, lon, so2_scd = plot_data
 
@@ -265,45 +423,52 @@ class MainWindow(QMainWindow):
         # Get the colormap limits
         map_lo_lim, map_hi_lim = self.cbar.levels()
 
-        # Normalise the data and convert to colors
-        norm_values = (self.so2_data - map_lo_lim) / (map_hi_lim - map_lo_lim)
-        np.nan_to_num(norm_values, copy=False)
-        pens = [pg.mkPen(color=self.cmap.map(val)) for val in norm_values]
-        brushes = [pg.mkBrush(color=self.cmap.map(val)) for val in norm_values]
-
         # Update map plots
+        self.map_lon = lon
+        self.map_lat = lat
         self.mapPlot.setData(x=lon, y=lat)
-        self.mapScatter.setData(x=lon, y=lat, pen=pens, brush=brushes)
+        self._update_map_scatter(lon, lat, so2_scd, map_lo_lim, map_hi_lim)
 
     def _update_map_colors(self):
         try:
-            lon, lat = self.mapScatter.getData()
-            so2_data = self.so2_data
+            if self.map_lon is None:
+                return
 
             # Get the colormap limits
             map_lo_lim, map_hi_lim = self.cbar.levels()
 
-            # Normalise the data and convert to colors
-            norm_values = (so2_data - map_lo_lim) / (map_hi_lim - map_lo_lim)
-            np.nan_to_num(norm_values, copy=False)
-
-            pens = [pg.mkPen(color=self.cmap.map(val)) for val in norm_values]
-            brushes = [pg.mkBrush(color=self.cmap.map(val))
-                       for val in norm_values]
-
-            self.mapScatter.setData(x=lon, y=lat, pen=pens, brush=brushes)
+            self._update_map_scatter(self.map_lon, self.map_lat,
+                                     self.so2_data, map_lo_lim, map_hi_lim)
         except ValueError:
             pass
 
+    def _update_map_scatter(self, lon, lat, values, lo_lim, hi_lim):
+        """Distribute the map points between the color bin scatters."""
+        # Grow the bin buffer if required
+        values = np.asarray(values, dtype=np.float64)
+        if values.size > self._bin_buf.size:
+            self._bin_buf = np.empty(max(values.size,
+                                         2 * self._bin_buf.size),
+                                     dtype=np.uint8)
+
+        # Quantize the values into the color bins
+        bins = _compute_color_bins(values, lo_lim, hi_lim, self._nmap_bins,
+                                   self._bin_buf)
+
+        # Update each bin scatter with its share of the points
+        for b, scatter in enumerate(self._bin_scatters):
+            mask = bins == b
+            scatter.setData(x=lon[mask], y=lat[mask])
+
     def sync_finished(self):
         """Finished signal."""
         self.update_status('Ready')
 
     def update_log(self, log_text):
         """Update logs from PiSpec."""
-        text = self.log.toPlainText().split('\n')
-        for line in log_text[len(text):]:
+        for line in log_text[self._log_nlines:]:
             self.log.appendPlainText(line.strip())
+        self._log_nlines = max(self._log_nlines, len(log_text))
 
     def update_status(self, status):
         """Update GUI status."""
@@ -316,36 +481,16 @@ class MainWindow(QMainWindow):
 
     def changeThemeDark(self):
         """Change theme to dark."""
-        darkpalette = QPalette()
-        darkpalette.setColor(QPalette.Window, QColor(53, 53, 53))
-        darkpalette.setColor(QPalette.WindowText, Qt.white)
-        darkpalette.setColor(QPalette.Base, QColor(25, 25, 25))
-        darkpalette.setColor(QPalette.AlternateBase, QColor(53, 53, 53))
-        darkpalette.setColor(QPalette.ToolTipBase, Qt.black)
-        darkpalette.setColor(QPalette.ToolTipText, Qt.white)
-        darkpalette.setColor(QPalette.Text, Qt.white)
-        darkpalette.setColor(QPalette.Button, QColor(53, 53, 53))
-        darkpalette.setColor(QPalette.Active, QPalette.Button,
-                             QColor(53, 53, 53))
-        darkpalette.setColor(QPalette.ButtonText, Qt.white)
-        darkpalette.setColor(QPalette.BrightText, Qt.red)
-        darkpalette.setColor(QPalette.Link, QColor(42, 130, 218))
-        darkpalette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-        darkpalette.setColor(QPalette.HighlightedText, Qt.black)
-        darkpalette.setColor(QPalette.Disabled, QPalette.ButtonText,
-                             Qt.darkGray)
-        QApplication.instance().setPalette(darkpalette)
-
-        pen = pg.mkPen('w', width=1.5)
+        QApplication.instance().setPalette(DARK_PALETTE)
 
         self.graphwin.setBackground('k')
         for ax in [self.graphAx, self.mapAx]:
-            ax.getAxis('left').setPen(pen)
-            ax.getAxis('right').setPen(pen)
-            ax.getAxis('top').setPen(pen)
-            ax.getAxis('bottom').setPen(pen)
-            ax.getAxis('left').setTextPen(pen)
-            ax.getAxis('bottom').setTextPen(pen)
+            ax.getAxis('left').setPen(self._axis_pen)
+            ax.getAxis('right').setPen(self._axis_pen)
+            ax.getAxis('top').setPen(self._axis_pen)
+            ax.getAxis('bottom').setPen(self._axis_pen)
+            ax.getAxis('left').setTextPen(self._axis_pen)
+            ax.getAxis('bottom').setTextPen(self._axis_pen)
 
     def closeEvent(self, event):
         """Handle GUI closure."""
@@ -355,7 +500,7 @@ class MainWindow(QMainWindow):
 
         # Write the config
         with open('bin/.config.yml', 'w') as outfile:
-            yaml.dump(config, outfile)
+            yaml.dump(config, outfile, Dumper=YamlDumper)
 
         try:
             self.syncWorker.stop()
@@ -369,7 +514,7 @@ class MainWindow(QMainWindow):
         """Load previous config."""
         try:
             with open('bin/.config.yml', 'r') as ymlfile:
-                config = yaml.load(ymlfile, Loader=yaml.FullLoader)
+                config = yaml.load(ymlfile, Loader=YamlLoader)
 
             for key, item in config.items():
                 try:
@@ -387,67 +532,135 @@ class SyncWorker(QObject):
     error = pyqtSignal(tuple)
     finished = pyqtSignal()
     updateLog = pyqtSignal(list)
-    updatePlots = pyqtSignal(list)
+    updatePlots = pyqtSignal(object)
     updateStatus = pyqtSignal(str)
 
-    def __init__(self, pispec):
+    def __init__(self, pispec, capacity=4096):
         """Initialise."""
         super(QObject, self).__init__()
         self.pispec = pispec
         self.is_stopped = False
 
+        # Preallocate the data buffer (doubled in size when full) so each
+        # tick only has to read and parse the newly appended CSV rows
+        self.capacity = capacity
+        self.buf = np.empty((self.capacity, 4), dtype=np.float64)
+        self.n = 0
+        self._csv_handle = None
+        self._columns = None
+        self._last_mtime = 0.0
+
     def run(self):
         """Launch worker task."""
+        # Drive the sync from a timer on this thread's event loop so stop
+        # requests are handled immediately instead of after a blocking sleep
+        self._timer = QTimer()
+        self._timer.setInterval(1000)
+        self._timer.timeout.connect(self._tick)
+        self._timer.start()
+        self._loop = QEventLoop()
+
+        # Run the first pass immediately, then hand over to the event loop
+        self._tick()
+        if not self.is_stopped:
+            self._loop.exec_()
+
+        self._timer.stop()
+        self.finished.emit()
+
+    def stop(self):
+        """Stop the worker."""
+        self.is_stopped = True
+        try:
+            self._loop.quit()
+        except AttributeError:
+            pass
+
+    def _tick(self):
+        """Run a single sync pass, trapping any errors."""
+        if self.is_stopped:
+            return
         try:
             self._run()
         except Exception:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]
             self.error.emit((exctype, value, traceback.format_exc()))
-        self.finished.emit()
-
-    def stop(self):
-        """Stop the worker."""
-        self.is_stopped = True
+            self.stop()
 
     def _run(self):
         """Worker task."""
-        while not self.is_stopped:
-
-            # Update status
-            self.updateStatus.emit('Working...')
-
-            # Pull PiSpec logs
-            self.pispec.pull_log()
-            with open(f'Results/{self.pispec.folder}/log.txt', 'r') as r:
-                log_text = r.readlines()
-            self.updateLog.emit(log_text)
-
-            # Update so2 results
-            update_flag = self.pispec.sync_so2_data()
-
-            if update_flag:
-                try:
-                    fname = f'Results/{self.pispec.folder}/so2_output.csv'
-                    df = pd.read_csv(fname, parse_dates=['Time'])
-
-                    dt = pd.Timedelta('1s')
-                    tstamp = np.array(
-                        (df['Time'] - pd.Timestamp('1970-01-01')) // dt)
-                    lat = df['Lat'].to_numpy()
-                    lon = df['Lon'].to_numpy()
-                    so2 = df['SO2_SCD_ppmm'].to_numpy()
-
-                    # Send signal to plotter
-                    self.updatePlots.emit([tstamp, lat, lon, so2])
-
-                except pd.errors.EmptyDataError:
-                    pass
-
-            # Update status
-            self.updateStatus.emit('Done')
-
-            time.sleep(1)
+        # Update status
+        self.updateStatus.emit('Working...')
+
+        # Pull the PiSpec log and any new results in a single SSH call
+        log_text, update_flag = self.pispec.sync_tick()
+        self.updateLog.emit(log_text)
+
+        if update_flag:
+            try:
+                fname = f'Results/{self.pispec.folder}/so2_output.csv'
+                self._read_new_rows(fname)
+
+                # Send views of the buffer to the plotter
+                if self.n:
+                    self.updatePlots.emit((self.buf[:self.n, 0],
+                                           self.buf[:self.n, 1],
+                                           self.buf[:self.n, 2],
+                                           self.buf[:self.n, 3]))
+
+            except pd.errors.EmptyDataError:
+                pass
+
+        # Update status
+        self.updateStatus.emit('Done')
+
+    def _read_new_rows(self, fname):
+        """Append any new CSV rows to the preallocated buffer."""
+        # Skip the read entirely if the file hasn't changed on disk
+        mtime = os.path.getmtime(fname)
+        if mtime == self._last_mtime:
+            return
+        self._last_mtime = mtime
+
+        # On the first read, or if the file has been replaced, open a
+        # persistent handle and capture the column names from the header
+        if self._csv_handle is None \
+                or os.path.getsize(fname) < self._csv_handle.tell():
+            if self._csv_handle is not None:
+                self._csv_handle.close()
+                self.n = 0
+            self._csv_handle = open(fname, 'r')
+            self._columns = self._csv_handle.readline().strip().split(',')
+
+        # Parse from the current file position to the end, restricting to
+        # the required columns with explicit dtypes to avoid any type
+        # inference. Raises EmptyDataError if there are no new rows.
+        df = pd.read_csv(self._csv_handle, header=None,
+                         names=self._columns,
+                         usecols=['Time', 'Lat', 'Lon', 'SO2_SCD_ppmm'],
+                         dtype={'Lat': 'float64', 'Lon': 'float64',
+                                'SO2_SCD_ppmm': 'float64'},
+                         parse_dates=['Time'], engine='c')
+
+        # Convert the timestamps to epoch seconds with a single view cast
+        tstamp = df['Time'].values.view('i8') // 1_000_000_000
+        rows = np.column_stack([tstamp,
+                                df['Lat'].to_numpy(),
+                                df['Lon'].to_numpy(),
+                                df['SO2_SCD_ppmm'].to_numpy()])
+
+        # Grow the buffer if required
+        nrows = len(rows)
+        while self.n + nrows > self.capacity:
+            self.capacity *= 2
+            new_buf = np.empty((self.capacity, 4), dtype=np.float64)
+            new_buf[:self.n] = self.buf[:self.n]
+            self.buf = new_buf
+
+        # Add the new rows to the buffer
+        self.buf[self.n:self.n+nrows] = rows
+        self.n += nrows
 
 
 # =============================================================================
@@ -3,11 +3,23 @@ import os
 import logging
 import linecache
 import numpy as np
+import pandas as pd
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 
+def _read_columns(fname):
+    """Parse a whitespace separated two-column spectrum file.
+
+    Uses the pandas C parser, which is much faster than np.loadtxt on
+    the per-spectrum text files.
+    """
+    df = pd.read_csv(fname, sep=r'\s+', engine='c', header=None,
+                     comment='#', dtype='float64')
+    return df[0].to_numpy(), df[1].to_numpy()
+
+
 # =============================================================================
 # read_spectrum
 # =============================================================================
@@ -283,7 +295,7 @@ def load_ifit(*args):
     fname = args[0]
 
     # Load data into a numpy array
-    grid, spec = np.loadtxt(fname, unpack=True)
+    grid, spec = _read_columns(fname)
 
     # Assert metadata data types
     int_types = ['spectrum_number', 'integration_time', 'coadds']
@@ -339,7 +351,7 @@ def load_ifit_old(*args):
     fname = args[0]
 
     # Load data into a numpy array
-    grid, spec = np.loadtxt(fname, unpack=True)
+    grid, spec = _read_columns(fname)
 
     # Extract metadata from the header
     with open(fname, 'r') as r:
@@ -1,6 +1,7 @@
 import os
 import logging
-from pssh.clients import SSHClient
+from gevent import joinall
+from pssh.clients import ParallelSSHClient
 
 logger = logging.getLogger(__name__)
 
@@ -21,24 +22,42 @@ class PiSpec():
         self.send_stop()
 
         # Get the current folder
-        output = self.client.run_command('ls /home/pi/drone/Results/')
-        self.folder = [f for f in output.stdout][-1]
+        self.folder = self._run_remote('ls /home/pi/drone/Results/')[-1]
 
         logger.info(f'Watching directory {self.folder}')
 
         if not os.path.isdir(f'Results/{self.folder}'):
             os.makedirs(f'Results/{self.folder}')
 
+        # Cache of the local result lines for fast deduplication on sync
+        self._loc_line_set = set()
+        self._loc_nlines = 0
+
     def send_start(self):
         """Send signal to start PiSpec."""
-        self.client.run_command('touch /home/pi/drone/bin/controlON')
+        self._run_remote('touch /home/pi/drone/bin/controlON')
         self.is_active = True
 
     def send_stop(self):
         """Send signal to stop PiSpec."""
-        self.client.run_command('rm /home/pi/drone/bin/controlON')
+        self._run_remote('rm /home/pi/drone/bin/controlON')
         self.is_active = False
 
+    def _run_remote(self, cmd):
+        """Run a remote command and return its stdout lines."""
+        output = self.client.run_command(cmd)
+        lines = [line.strip() for line in output[0].stdout]
+        self.client.join(output)
+        return lines
+
+    def _copy_remote_file(self, rem_file, loc_file):
+        """Copy a single remote file, preserving the local file name."""
+        # The empty copy_args stops the client appending the hostname to
+        # the local file name
+        greenlets = self.client.copy_remote_file(rem_file, loc_file,
+                                                 copy_args=[{}])
+        joinall(greenlets, raise_error=True)
+
     def copy_so2_data(self):
         """Update so2 results file."""
         # Set up local folder
@@ -46,33 +65,101 @@ class PiSpec():
         if not os.path.isdir(loc_folder):
             os.makedirs(loc_folder)
 
-        self.client.copy_remote_file(
+        self._copy_remote_file(
             f'/home/pi/drone/Results/{self.folder}/so2_output.csv',
             f'{loc_folder}/so2_output.csv')
 
     def sync_so2_data(self, buffer_len=100):
         """."""
         loc_file = f'Results/{self.folder}/so2_output.csv'
-        try:
-            with open(loc_file, 'r') as r:
-                loc_lines = [line.strip() for line in r.readlines()]
-        except FileNotFoundError:
-            self.copy_so2_data()
-            return True
+
+        # On the first sync read the local file into the line cache,
+        # pulling the full file from the PiSpec if it doesn't exist yet
+        if not self._loc_line_set:
+            try:
+                self._load_loc_lines(loc_file)
+            except FileNotFoundError:
+                self.copy_so2_data()
+                self._load_loc_lines(loc_file)
+                return True
 
         rem_file = f'/home/pi/drone/Results/{self.folder}/so2_output.csv'
-        cmd = f'tail -n {int(buffer_len)} {rem_file}'
-        output = self.client.run_command(cmd)
-        rem_lines = [line.strip() for line in output.stdout]
+        rem_lines = self._run_remote(f'tail -n {int(buffer_len)} {rem_file}')
+
+        return self._append_new_lines(loc_file, rem_lines)
+
+    def sync_tick(self, buffer_len=100):
+        """Pull the log and any new SO2 results in one remote command.
+
+        Batches the log read and the results tail into a single
+        run_command call so each sync tick pays one SSH round trip
+        instead of one per file.
+
+        Parameters
+        ----------
+        buffer_len : int, optional
+            The number of lines to tail from the remote results file.
+            Default is 100
+
+        Returns
+        -------
+        log_lines : list
+            The lines of the remote log file
+        updated_flag : bool
+            True if new result lines were added to the local file
+        """
+        rem_dir = f'/home/pi/drone/Results/{self.folder}'
+        cmd = f'echo "---LOG---"; cat {rem_dir}/log.txt; ' \
+              + f'echo "---SO2---"; tail -n {int(buffer_len)} ' \
+              + f'{rem_dir}/so2_output.csv'
+
+        # Split the output stream on the sentinel lines
+        log_lines = []
+        so2_lines = []
+        target = None
+        for line in self._run_remote(cmd):
+            if line == '---LOG---':
+                target = log_lines
+            elif line == '---SO2---':
+                target = so2_lines
+            elif target is not None:
+                target.append(line)
+
+        # On the first sync read the local file into the line cache,
+        # pulling the full file from the PiSpec if it doesn't exist yet
+        loc_file = f'Results/{self.folder}/so2_output.csv'
+        if not self._loc_line_set:
+            try:
+                self._load_loc_lines(loc_file)
+            except FileNotFoundError:
+                self.copy_so2_data()
+                self._load_loc_lines(loc_file)
+                return log_lines, True
 
-        updated_flag = False
-        with open(loc_file, 'a') as w:
-            for line in rem_lines:
-                if line not in loc_lines:
-                    updated_flag = True
-                    w.write(line + '\n')
+        return log_lines, self._append_new_lines(loc_file, so2_lines)
 
-        return updated_flag
+    def _append_new_lines(self, loc_file, rem_lines):
+        """Append any unseen remote lines to the local results file."""
+        new_lines = [line for line in rem_lines
+                     if line not in self._loc_line_set]
+        if not new_lines:
+            return False
+
+        # Append all the new lines in a single buffered write
+        with open(loc_file, 'a', buffering=1 << 20) as w:
+            w.write('\n'.join(new_lines) + '\n')
+
+        self._loc_line_set.update(new_lines)
+        self._loc_nlines += len(new_lines)
+
+        return True
+
+    def _load_loc_lines(self, loc_file):
+        """Cache the lines already held in the local results file."""
+        with open(loc_file, 'r') as r:
+            for line in r:
+                self._loc_line_set.add(line.strip())
+                self._loc_nlines += 1
 
     def sync_results(self):
         """Check for new measurement results."""
@@ -82,26 +169,29 @@ class PiSpec():
             os.makedirs(loc_folder)
 
         # Get remote files
-        output = self.client.run_command(
-            f'ls /home/pi/drone/Results/{self.folder}/meas/meas*')
-        rem_files = [os.path.split(f)[1] for f in output.stdout]
+        rem_files = [
+            os.path.split(f)[1] for f in self._run_remote(
+                f'ls /home/pi/drone/Results/{self.folder}/meas/meas*')]
 
         # Get local files
         loc_files = os.listdir(loc_folder)
 
         # Find remote files missing from local files
         files_to_sync = [f for f in rem_files if f not in loc_files]
-        synced_files = []
 
-        # Pull any missing files
+        # Pull all the missing files concurrently over the shared session
+        greenlets = []
         for file in files_to_sync:
-            try:
-                self.client.copy_remote_file(
-                    f'/home/pi/drone/Results/{self.folder}/meas/{file}',
-                    f'{loc_folder}/{file}')
+            greenlets += self.client.copy_remote_file(
+                f'/home/pi/drone/Results/{self.folder}/meas/{file}',
+                f'{loc_folder}/{file}', copy_args=[{}])
+        joinall(greenlets)
+
+        # Record the successful transfers
+        synced_files = []
+        for file, greenlet in zip(files_to_sync, greenlets):
+            if greenlet.successful():
                 synced_files.append(f'{loc_folder}/{file}')
-            except Exception:
-                pass
 
         return synced_files
 
@@ -114,9 +204,9 @@ class PiSpec():
             os.makedirs(loc_folder)
 
         # Get remote files
-        output = self.client.run_command(
-            f'ls /home/pi/drone/Results/{self.folder}/spectrum*')
-        rem_files = [os.path.split(f)[1] for f in output.stdout]
+        rem_files = [
+            os.path.split(f)[1] for f in self._run_remote(
+                f'ls /home/pi/drone/Results/{self.folder}/spectrum*')]
 
         # Get local files
         loc_files = os.listdir(loc_folder)
@@ -124,23 +214,27 @@ class PiSpec():
         # Find remote files missing from local files
         files_to_sync = [f for f in rem_files if f not in loc_files]
 
-        # Pull any missing files
+        # Pull all the missing files concurrently over the shared session
+        greenlets = []
         for file in files_to_sync:
-            self.client.copy_remote_file(
+            greenlets += self.client.copy_remote_file(
                 f'/home/pi/drone/Results/{self.folder}/{file}',
-                f'{loc_folder}/{file}')
+                f'{loc_folder}/{file}', copy_args=[{}])
+        joinall(greenlets, raise_error=True)
 
         return files_to_sync
 
     def pull_log(self):
         """Pull PiSpec logs."""
-        self.client.copy_remote_file(
+        self._copy_remote_file(
             f'/home/pi/drone/Results/{self.folder}/log.txt',
             f'Results/{self.folder}/log.txt')
 
     def connect(self):
         """Connect the session."""
-        self.client = SSHClient(self.host, self.user, self.password)
+        self.client = ParallelSSHClient([self.host], user=self.user,
+                                        password=self.password,
+                                        num_retries=1, keepalive_seconds=30)
         logger.info(f'Connected to {self.user}@{self.host}')
 
     def disconnect(self):
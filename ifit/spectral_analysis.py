@@ -1,4 +1,5 @@
 """Contains functions for fitting spectra."""
+import os
 import logging
 import numpy as np
 from scipy.optimize import curve_fit
@@ -11,6 +12,32 @@ from ifit.make_ils import make_ils
 logger = logging.getLogger(__name__)
 
 
+def _load_ref(path):
+    """Load a two-column reference file, caching a binary copy.
+
+    The ASCII file is only parsed on the first load; later loads
+    memory-map a cached .npy copy so forked worker processes share the
+    pages instead of re-parsing the text.
+    """
+    npy_path = os.path.splitext(path)[0] + '.npy'
+
+    # Use the cached copy if it is up to date
+    try:
+        if os.path.getmtime(npy_path) >= os.path.getmtime(path):
+            return np.load(npy_path, mmap_mode='r')
+    except OSError:
+        pass
+
+    # Otherwise parse the ASCII file and write the cache
+    data = np.loadtxt(path, unpack=True)
+    try:
+        np.save(npy_path, data)
+    except OSError:
+        logger.debug(f'Unable to cache reference file {path}')
+
+    return data
+
+
 # =============================================================================
 # =============================================================================
 # # Spectral Analyser
@@ -122,7 +149,7 @@ class Analyser():
 
             try:
                 # Import the flat spectrum
-                self.flat = np.loadtxt(flat_path, unpack=True)
+                self.flat = _load_ref(flat_path)
                 logger.info('Flat spectrum imported')
 
             except OSError:
@@ -186,10 +213,14 @@ class Analyser():
 
         # Import solar reference spectrum
         logger.info('Importing solar reference spectrum...')
-        sol_x, sol_y = np.loadtxt(frs_path, unpack=True)
-
-        # Interpolate onto model_grid
-        self.init_frs = griddata(sol_x, sol_y, self.model_grid, method='cubic')
+        sol_x, sol_y = _load_ref(frs_path)
+
+        # Interpolate onto model_grid. The references are stored as
+        # float32, ample precision for the reference data, though the
+        # model itself is evaluated in float64 so curve_fit's tiny finite
+        # difference steps are not rounded away
+        self.init_frs = griddata(sol_x, sol_y, self.model_grid,
+                                 method='cubic').astype(np.float32)
         self.frs = self.init_frs.copy()
 
         logger.info('Solar reference spectrum imported')
@@ -211,11 +242,12 @@ class Analyser():
                 logger.info(f'Importing {name} reference spectrum...')
 
                 # Read in the cross-section
-                x, xsec = np.loadtxt(param.xpath, unpack=True)
+                x, xsec = _load_ref(param.xpath)
 
                 # Interpolate onto the model grid
-                self.init_xsecs[name] = griddata(x, xsec, self.model_grid,
-                                                 method='cubic')
+                self.init_xsecs[name] = griddata(
+                    x, xsec, self.model_grid,
+                    method='cubic').astype(np.float32)
 
                 logger.info(f'{name} cross-section imported')
 
@@ -238,6 +270,24 @@ class Analyser():
         self.spike_limit = spike_limit
         self.bad_pixels = bad_pixels
 
+        # Stack the cross-sections into a dense matrix for the forward model
+        self._build_xsec_matrix()
+
+    def _build_xsec_matrix(self):
+        """Stack the gas cross-sections into a single dense matrix.
+
+        The forward model then computes all the gas optical depths with one
+        matrix-vector product instead of looping over the gases in Python.
+        """
+        # The matrix is float64 as the fit differentiates the forward
+        # model with steps below float32 resolution
+        self._xsec_names = list(self.xsecs.keys())
+        self._xsec_matrix = np.ascontiguousarray(
+            [self.xsecs[name] for name in self._xsec_names],
+            dtype=np.float64)
+        self._plume_mask = np.array(
+            [self.params[name].plume_gas for name in self._xsec_names])
+
 # =============================================================================
 #   Spectrum Pre-processing
 # =============================================================================
@@ -414,6 +464,9 @@ class Analyser():
             # Update the fit window attribute
             self.fit_window = fit_window
 
+            # Rebuild the cross-section matrix on the trimmed grid
+            self._build_xsec_matrix()
+
         # Check is spectrum requires preprocessing
         if pre_process:
             spectrum = self.pre_process(spectrum, prefit_shift)
@@ -507,20 +560,12 @@ class Analyser():
         bg_poly = np.polyval(bg_poly_coefs, self.model_grid)
         frs = np.multiply(self.frs, bg_poly)
 
-        # Create empty arrays to hold optical depth spectra
-        plm_gas_T = np.zeros((len(self.xsecs), len(self.model_grid)))
-        sky_gas_T = np.zeros((len(self.xsecs), len(self.model_grid)))
-
-        # Calculate the gas optical depth spectra
-        for n, gas in enumerate(self.xsecs):
-            if self.params[gas].plume_gas:
-                plm_gas_T[n] = (np.multiply(self.xsecs[gas], p[gas]))
-            else:
-                sky_gas_T[n] = (np.multiply(self.xsecs[gas], p[gas]))
-
-        # Sum the gas ODs
-        sum_plm_T = np.sum(np.vstack([plm_gas_T, sky_gas_T]), axis=0)
-        sky_plm_T = np.sum(sky_gas_T, axis=0)
+        # Calculate the summed gas optical depth spectra as matrix-vector
+        # products with the stacked cross-sections, with the plume gases
+        # zeroed out for the sky spectrum
+        amounts = np.array([p[gas] for gas in self._xsec_names])
+        sum_plm_T = amounts @ self._xsec_matrix
+        sky_plm_T = np.where(self._plume_mask, 0, amounts) @ self._xsec_matrix
 
         # Build the exponent term
         plm_exponent = np.exp(-sum_plm_T)
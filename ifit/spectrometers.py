@@ -94,7 +94,7 @@ class Spectrometer():
         self.coadds = coadds
         logger.info(f'Updated coadds to {coadds}')
 
-    def get_spectrum(self, fname=None, gps=None):
+    def get_spectrum(self, fname=None, gps=None, out=None):
         """Read a spectrum from the spectrometer.
 
         Parameters
@@ -104,27 +104,36 @@ class Spectrometer():
             not saved
         gps : ifit.gps.GPS object, optional
             GPS object to record specra position information. Default is None
+        out : numpy array, optional
+            Preallocated buffer to hold the measured intensities, avoiding an
+            allocation per spectrum. If None a new array is created. Default
+            is None
 
         Returns
         -------
-        spectrum : numpy array
-            2D array holding the spectrum wavelengths and intensities
+        spectrum : list
+            The spectrum wavelengths and intensities as [x, y]
         info : dict
             Contains the metadata for the spectrum
         """
         # Get the wavelengths
         x = self.spectro.wavelengths()
 
-        # Create an empty array to hold the spectra data
-        y_arr = np.zeros([self.coadds, len(x)])
+        # Accumulate the coadded spectra in place, avoiding the
+        # (coadds, pixels) scratch array
+        if out is None:
+            y = np.zeros(len(x))
+        else:
+            y = out
+            y[:] = 0
 
         # Measure spectra from the spectrometer
         for n in range(self.coadds):
-            y_arr[n] = self.spectro.intensities(self.correct_dark_counts,
-                                                self.correct_nonlinearity)
+            y += self.spectro.intensities(self.correct_dark_counts,
+                                          self.correct_nonlinearity)
 
         # Average the coadded spectra
-        y = np.average(y_arr, axis=0)
+        y /= self.coadds
 
         # Get the spectrum timestamp
         timestamp = datetime.now()
@@ -172,7 +181,7 @@ class Spectrometer():
             self.spec_no += 1
 
         # Return the measured spectrum
-        return [np.row_stack([x, y]), info]
+        return [[x, y], info]
 
     def close(self):
         """Close the connection to the spectrometer."""
@@ -9,19 +9,68 @@ import logging
 import numpy as np
 from datetime import datetime
 import serial.tools.list_ports
-from multiprocessing import Process, Queue
+import multiprocessing
+from multiprocessing import shared_memory
+from queue import Queue, Empty
+from threading import Thread, BoundedSemaphore
+from concurrent.futures import ProcessPoolExecutor
 
 from ifit.spectrometers import Spectrometer
 from ifit.gps import GPS
-from ifit.load_spectra import read_spectrum
 from ifit.parameters import Parameters
 from ifit.spectral_analysis import Analyser
 
+# inotify is optional, used to wait on the control file without polling
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
 
-def analyse_spec(spec_fname, analyser, fpath, q):
+
+# The analyser is built once in run() and inherited by the forked worker
+# processes, avoiding a pickle of the reference spectra per spectrum
+analyser = None
+
+# Ring of shared memory blocks and the fixed wavelength axis, set up in
+# run() and inherited by the workers so spectra cross the process
+# boundary without being pickled
+spec_shms = None
+spec_x = None
+
+
+def _pin_to_cores(cores):
+    """Pin the calling process to the given set of CPU cores.
+
+    Keeping the acquisition loop and the fit workers on separate cores
+    stops the scheduler migrating the loop and cold-starting its small
+    working set in cache.
+    """
+    try:
+        os.sched_setaffinity(0, cores)
+    except (AttributeError, OSError):
+        pass
+
+
+def _drop_page_cache(fd):
+    """Ask the kernel to drop the cached pages of the given file.
+
+    The saved spectra are written once and never re-read by this
+    process, so their pages only inflate the Pi's page cache and force
+    reclaim stalls in the acquisition loop.
+    """
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError):
+        pass
+
+
+def analyse_spec(meas_fname, block_idx, info):
     """."""
-    # Read in the spectrum
-    x, y, info, err = read_spectrum(spec_fname, spec_type='iFit')
+    # Rebuild the spectrum from the inherited shared memory block,
+    # copying it out in case the ring wraps during a slow fit
+    x = spec_x
+    y = np.ndarray(x.size, dtype=np.float32,
+                   buffer=spec_shms[block_idx].buf).copy()
 
     # Fit the spectrum
     fit = analyser.fit_spectrum(spectrum=[x, y],
@@ -41,39 +90,58 @@ def analyse_spec(spec_fname, analyser, fpath, q):
            fit.params['SO2'].fit_val/conv, fit.params['SO2'].fit_err/conv,
            info['integration_time'], np.max(fit.spec)]
 
-    head, tail = os.path.split(spec_fname)
-    meas_fname = f"{head}/meas/{tail.replace('spectrum', 'meas')}"
-
     with open(meas_fname, 'w') as w:
-        for r in res:
-            w.write(f'{r},')
-    q.put(res)
+        w.write(','.join(map(str, res)) + '\n')
+
+    return res
 
 
 def listener(q, save_fname):
     """."""
-    # Handle writing the results file
-    with open(save_fname, 'w') as w:
-
-        # Write the header
-        h = 'Time,Lat,Lon,Alt,X,Y,ZoneNum,ZoneLett,SO2_SCD_mol,SO2_err_mol,' \
-            + 'SO2_SCD_ppmm,SO2_err_ppmm,IntegrationTime,Intensity'
-        w.write(h + '\n')
-        print('Time\tLat\tLon\tAlt\tSO2_SCD_ppmm\tSO2_err_ppmm')
-
-        while True:
-            # Unpack the results
-            res = q.get()
-            if res == 'kill':
-                break
-            else:
-                msg = str(res[0])
-                for r in res[1:]:
-                    msg += f',{r}'
-                w.write(msg + '\n')
-                w.flush()
-                print(f'{res[0]}\t{res[1]}\t{res[2]}\t{res[3]}\t{res[10]}\t'
-                      + f'{res[11]}')
+    # Write through a raw file descriptor, accumulating rows in a buffer
+    # so each flush costs a single syscall
+    fd = os.open(save_fname, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+
+    # Write the header
+    h = 'Time,Lat,Lon,Alt,X,Y,ZoneNum,ZoneLett,SO2_SCD_mol,SO2_err_mol,' \
+        + 'SO2_SCD_ppmm,SO2_err_ppmm,IntegrationTime,Intensity'
+    os.write(fd, (h + '\n').encode())
+    print('Time\tLat\tLon\tAlt\tSO2_SCD_ppmm\tSO2_err_ppmm')
+
+    buf = bytearray()
+    last_flush = time.monotonic()
+
+    while True:
+        # Unpack the results, flushing the buffer if the queue is quiet
+        try:
+            res = q.get(timeout=2)
+        except Empty:
+            if buf:
+                os.write(fd, buf)
+                buf.clear()
+            last_flush = time.monotonic()
+            continue
+
+        if res == 'kill':
+            break
+
+        msg = str(res[0])
+        for r in res[1:]:
+            msg += f',{r}'
+        buf += (msg + '\n').encode()
+        print(f'{res[0]}\t{res[1]}\t{res[2]}\t{res[3]}\t{res[10]}\t'
+              + f'{res[11]}')
+
+        # Flush once the buffer is large or old enough
+        if len(buf) > 64 * 1024 or time.monotonic() - last_flush > 2.0:
+            os.write(fd, buf)
+            buf.clear()
+            last_flush = time.monotonic()
+
+    # Flush any remaining rows
+    if buf:
+        os.write(fd, buf)
+    os.close(fd)
 
 
 # =============================================================================
@@ -82,6 +150,12 @@ def listener(q, save_fname):
 
 def run():
     """Run main program loop."""
+    # Keep the acquisition loop on the last core, the fit workers are
+    # pinned to the others when the pool is created
+    n_cores = os.cpu_count() or 1
+    if n_cores > 1:
+        _pin_to_cores({n_cores - 1})
+
     # Get the logger
     logger = logging.getLogger()
 
@@ -111,7 +185,7 @@ def run():
     # Set the target intensity
     target_int = config['TargetIntensity']
 
-    # Construct an array of intergration times
+    # Construct a sorted array of intergration times
     int_times = np.arange(config['MinIntTime'],
                           config['MaxIntTime'] + config['IntTimeStep'],
                           config['IntTimeStep'])
@@ -141,9 +215,6 @@ def run():
     f_handler.setFormatter(f_formatter)
     logger.addHandler(f_handler)
 
-    # Initialise a process list
-    processes = []
-
 # =============================================================================
 #   Set up iFit analyser
 # =============================================================================
@@ -155,7 +226,9 @@ def run():
         info['value'] = float(info['value'])
         params.add(name, **info)
 
-    # Generate the analyser
+    # Generate the analyser, held in a module global so the forked worker
+    # processes inherit it
+    global analyser
     analyser = Analyser(params,
                         fit_window=config['FitWindow'],
                         frs_path='Ref/sao2010.txt',
@@ -173,82 +246,191 @@ def run():
     # Initialise a counter
     i = 0
 
-    # Generate the writing queue
+    # Preallocate the intensity buffer, reused for every spectrum
+    y_buf = np.empty(spectro.pixels, dtype=np.float32)
+
+    # Create the ring of shared memory blocks used to hand spectra to
+    # the workers, inherited when the pool forks on the first submit
+    global spec_shms, spec_x
+    spec_shms = [shared_memory.SharedMemory(create=True,
+                                            size=spectro.pixels * 4)
+                 for _ in range(8)]
+
+    # Generate the writing queue, drained by a background thread - the
+    # listener only appends to a file so needs no separate process
     save_fname = f'{fpath}/so2_output.csv'
     q = Queue()
-    listen = Process(target=listener, args=[q, save_fname])
-    listen.daemon = True
+    listen = Thread(target=listener, args=[q, save_fname], daemon=True)
     listen.start()
 
-    # Start switched OFF
+    # Create a persistent pool of forked analysis workers, so each one
+    # inherits the analyser instead of re-pickling it per spectrum
+    executor = ProcessPoolExecutor(
+        max_workers=3, mp_context=multiprocessing.get_context('fork'),
+        initializer=_pin_to_cores,
+        initargs=(set(range(max(n_cores - 1, 1))),))
+
+    # Track the free workers with a semaphore, giving an O(1) gate on
+    # submission with no per-iteration polling of the futures
+    fit_slots = BoundedSemaphore(3)
+
+    def forward_result(future):
+        """Pass completed fit results on to the writing queue."""
+        try:
+            q.put(future.result())
+        except Exception:
+            logger.exception('Spectrum analysis failed!')
+        finally:
+            fit_slots.release()
+
+    # Open the binary spectra file, an append-only block of float32
+    # intensities with a small text index, so each spectrum costs one
+    # sequential write instead of a new file and its ASCII encoding
+    spectra_fd = os.open(f'{fpath}/spectra.f32',
+                         os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    spec_offset = 0
+    index_file = open(f'{fpath}/spectra_index.csv', 'a')
+    index_file.write('SpecNo,Timestamp,Lat,Lon,Alt,IntegrationTime,'
+                     + 'Coadds,Offset\n')
+
+    # Start switched OFF, clearing any stale control file
     control_file = '/home/pi/drone/bin/controlON'
-    if os.path.isfile(control_file):
+    try:
         os.remove(control_file)
+    except FileNotFoundError:
+        pass
+    control_on = False
+
+    # Watch the control file with inotify so the loop blocks in the kernel
+    # until the state changes, instead of polling every second
+    if INotify is not None:
+        inotify = INotify()
+        watch_flags = (flags.CREATE | flags.DELETE | flags.MOVED_TO
+                       | flags.MOVED_FROM)
+        inotify.add_watch(os.path.dirname(control_file), watch_flags)
+    else:
+        inotify = None
+        logger.warning('inotify not available, falling back to polling')
+
+    # The fallback polling starts fast and backs off while quiescent, so a
+    # toggle is caught quickly without spinning when idle
+    poll_backoff = 0.01
 
     logger.info('PiSpec ready!')
 
     while True:
 
-        # Get the status
-        if not os.path.isfile(control_file):
-            time.sleep(1)
+        # Get the status. With inotify, block until the control file
+        # changes while switched off and just drain any pending events
+        # while switched on
+        if inotify is not None:
+            timeout = None if not control_on else 0
+            for event in inotify.read(timeout=timeout):
+                if event.name == os.path.basename(control_file):
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        control_on = True
+                    elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                        control_on = False
+        else:
+            control_on = os.path.isfile(control_file)
+            if control_on:
+                poll_backoff = 0.01
+
+        if not control_on:
+            if inotify is None:
+                time.sleep(poll_backoff)
+                poll_backoff = min(1.0, poll_backoff * 1.5)
             continue
 
         try:
 
-            # Format the spectrum name and read
-            spec_fname = f'{fpath}/spectrum_{i:05d}.txt'
-            [x, y], info = spectro.get_spectrum(spec_fname, gps=gps)
+            # Read the spectrum into the reused buffer
+            [x, y], info = spectro.get_spectrum(gps=gps, out=y_buf)
+
+            # Save the wavelength axis once, it is fixed per device
+            if i == 0:
+                np.save(f'{fpath}/wavelengths.npy', x)
+                spec_x = x
+
+            # Copy the spectrum into the next shared memory block, used
+            # both for the binary save and the worker handoff
+            block = np.ndarray(spectro.pixels, dtype=np.float32,
+                               buffer=spec_shms[i % 8].buf)
+            block[:] = y
+
+            # Append the intensities to the binary spectra file and
+            # record the spectrum in the index
+            os.write(spectra_fd, block.tobytes())
+            index_file.write(f'{i},{info["timestamp"]},{info["lat"]},'
+                             + f'{info["lon"]},{info["alt"]},'
+                             + f'{info["integration_time"]},'
+                             + f'{info["coadds"]},{spec_offset}\n')
+            spec_offset += block.nbytes
+
+            # The saved spectra are never read back, drop them from the
+            # page cache to keep the RAM free for the analysis
+            _drop_page_cache(spectra_fd)
 
             # Find the maximum intensity
-            max_int = np.max(y)
+            max_int = y.max()
 
-            # Scale the intensity to the target
-            scale = target_int / max_int
+            # Scale the integration time towards the target intensity
+            int_time = spectro.integration_time * (target_int / max_int)
 
-            # Scale the integration time by this factor
-            int_time = spectro.integration_time * scale
-
-            # Find the nearest value
-            diff = ((int_times - int_time)**2)**0.5
-            idx = np.where(diff == min(diff))[0][0]
-            new_int_time = int(int_times[idx])
+            # Snap to the nearest allowed time, a single pass beats a
+            # bisection on an array this small
+            new_int_time = int(int_times[np.abs(int_times
+                                                - int_time).argmin()])
 
             # Update the integration time
             if new_int_time != spectro.integration_time:
                 spectro.update_integration_time(new_int_time)
 
-            # Clear any finished processes from the processes list
-            processes = [p for p in processes if p.is_alive()]
-
-            if len(processes) < 3:
-
-                # Create new process to handle fitting of the last scan
-                p = Process(target=analyse_spec,
-                            args=[spec_fname, analyser, fpath, q])
-
-                # Add to array of active processes
-                processes.append(p)
-
-                # Begin the process
-                p.start()
+            # Skip the fit if the spectrum is dark or saturated, the
+            # integration time update above will pull it back into range
+            if max_int < 500 or max_int >= 60000:
+                logger.info(f'Spectrum {i} dark or saturated, not analysed')
+                i += 1
+                continue
+
+            # Take a fit slot if one is free, it is given back by the
+            # callback once the fit completes
+            if fit_slots.acquire(blocking=False):
+
+                # Submit the spectrum for analysis, handing the worker
+                # the block index and forwarding the result to the
+                # writing queue once the fit completes
+                meas_fname = f'{fpath}/meas/meas_{i:05d}.txt'
+                future = executor.submit(analyse_spec, meas_fname, i % 8,
+                                         info)
+                future.add_done_callback(forward_result)
 
             else:
-                # Log that the process was not started
-                logger.warning('Too many processes! Spectrum {i} not analysed')
+                # Log that the fit was not started
+                logger.warning(f'Too many processes! Spectrum {i} not'
+                               + ' analysed')
 
             i += 1
 
         except KeyboardInterrupt:
-            q.put('kill')
             break
 
     logger.info('Program ended')
 
-    # Complete processes
+    # Complete any outstanding fits before stopping the listener
+    executor.shutdown()
+    q.put('kill')
     listen.join()
-    for p in processes:
-        p.join()
+
+    # Close the spectra file and index
+    os.close(spectra_fd)
+    index_file.close()
+
+    # Drop the last view of the ring then release it
+    block = None
+    for shm in spec_shms:
+        shm.close()
+        shm.unlink()
 
 
 if __name__ == '__main__':